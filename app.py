@@ -3,14 +3,32 @@ Email Extractor Backend
 Flask application to handle file uploads and extract emails
 """
 
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, send_from_directory
 import re
 import os
 import csv
 import json
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import NotFound
 from datetime import datetime
 import io
+import heapq
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+try:
+    import re2
+except ImportError:  # Optional, falls back to re
+    re2 = None
+
+try:
+    import orjson
+except ImportError:  # Optional, falls back to json
+    orjson = None
 
 app = Flask(__name__)
 
@@ -21,73 +39,350 @@ app.config['OUTPUT_FOLDER'] = 'outputs'
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 
 # Allowed extensions (basically any text-based file)
-ALLOWED_EXTENSIONS = {
+ALLOWED_EXTENSIONS = frozenset({
     'txt', 'csv', 'json', 'html', 'htm', 'xml', 'log', 'md', 
     'js', 'py', 'php', 'sql', 'yaml', 'yml', 'ini', 'cfg',
     'conf', 'tsv', 'rtf', 'tex', 'sh', 'bat', 'ps1'
-}
+})
 
 # Create necessary directories
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+# Summaries of the latest extractions, newest first, kept in memory so
+# /api/history doesn't re-read every result file on each request. They are
+# reloaded whenever the output folder changes, by this or another worker.
+HISTORY_SIZE = 20
+HISTORY_INDEX = deque(maxlen=HISTORY_SIZE)
+history_lock = threading.Lock()
+history_mtime = None  # Output folder mtime when the index was last loaded
+# A folder changed this recently may change again without a new mtime
+MTIME_GRANULARITY_NS = 1000000000
+
+# Email pattern, compiled once at import instead of on every request.
+# It runs on bytes: emails are ASCII, so no decoding is needed.
+EMAIL_PATTERN = rb"[a-zA-Z0-9._%+\-]+@[a-zA-Z0-9.\-]+\.[a-zA-Z]{2,}"
+# The same pattern as text, the default for the pattern query parameter
+DEFAULT_PATTERN = EMAIL_PATTERN.decode('ascii')
+EMAIL_RE_BYTES = re.compile(EMAIL_PATTERN)
+# RE2 matches in linear time, so no input can make it backtrack.
+# It costs more per call, so only regions longer than this use it.
+EMAIL_RE_LINEAR = (re2 or re).compile(EMAIL_PATTERN)
+LINEAR_REGION_SIZE = 64
+# Every byte an email match can contain; matches never cross any other byte
+EMAIL_CHARS = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._%+-@'
+EMAIL_RUN_RE = re.compile(rb"[a-zA-Z0-9._%+\-@]*")
+# Longest valid email address (RFC 5321)
+MAX_EMAIL_LENGTH = 254
+# Characters not allowed in file names shown or served back to the client
+FILENAME_RE = re.compile(r'[^A-Za-z0-9_.-]')
+# Uploads are scanned in chunks of this size instead of being read whole
+STREAM_CHUNK_SIZE = 64 * 1024
+# Uploads bigger than this are scanned in blocks of this size in parallel
+PARALLEL_BLOCK_SIZE = 1024 * 1024
+# Worker processes for those blocks, capped since every server worker
+# gets its own pool; pointless on a single core. gunicorn_conf.py sets it
+# to 0, since its workers already use every core.
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', min(4, os.cpu_count() or 1)))
+# Seconds to wait for the workers to scan all blocks of one upload
+SCAN_TIMEOUT = 60
+# Created per process by get_scan_executor
+scan_executor = None
+scan_executor_pid = None
+scan_executor_lock = threading.Lock()
+
+
+def get_scan_executor():
+    """Return this process's scan pool, creating it on first use"""
+    # A pool inherited through fork (e.g. by gunicorn workers with
+    # preload_app) shares its pipes with the parent, so each process
+    # needs its own
+    global scan_executor, scan_executor_pid
+    # Scan inline on a single core or where there is no fork server (Windows)
+    if SCAN_WORKERS < 2 or 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    with scan_executor_lock:
+        if scan_executor is None or scan_executor_pid != os.getpid():
+            # Start workers from a fork server, not by forking a threaded process
+            scan_executor = ProcessPoolExecutor(
+                max_workers=SCAN_WORKERS,
+                mp_context=multiprocessing.get_context('forkserver')
+            )
+            scan_executor_pid = os.getpid()
+        return scan_executor
+
+
+def discard_scan_executor(executor):
+    """Drop a broken scan pool so the next block starts a new one"""
+    global scan_executor
+    with scan_executor_lock:
+        # Another request may already have replaced it
+        if scan_executor is executor:
+            scan_executor = None
+    executor.shutdown(wait=False)
+
+
+def submit_scan(data):
+    """Hand a block to the scan pool, returning (executor, future) or (None, None)"""
+    executor = get_scan_executor()
+    if executor is None:
+        return None, None
+    try:
+        return executor, executor.submit(find_emails_in_bytes, data)
+    except BrokenProcessPool:
+        discard_scan_executor(executor)
+        return None, None
+
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    if '.' not in filename:
+    _, dot, ext = filename.rpartition('.')
+    if not dot:
         return True  # Allow files without extension
-    return filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return ext.lower() in ALLOWED_EXTENSIONS
+
+
+def clean_filename(filename):
+    """Make a file name safe to store or serve, like secure_filename"""
+    # Stripping dots and underscores also rules out '..' and hidden files
+    return FILENAME_RE.sub('_', filename).strip('._')[:255]
+
+
+@lru_cache(maxsize=64)
+def get_pattern(pattern):
+    """Compile a pattern once and reuse it across requests"""
+    # Only RE2 keeps user-supplied patterns from backtracking on large uploads
+    return re2.compile(pattern)
 
 
-def extract_emails_from_text(text):
+def pattern_error(pattern):
+    """Return why a requested pattern can't be used, or None if it can"""
+    if pattern == DEFAULT_PATTERN:
+        return None
+    if re2 is None:
+        return 'Custom patterns require google-re2 on the server'
+    try:
+        get_pattern(pattern)
+    except re2.error:
+        return 'Invalid pattern'
+    return None
+
+
+def extract_emails_from_text(text, pattern=DEFAULT_PATTERN):
     """
     Extract emails from text using regex
-    Same pattern as the original script
+    Same pattern as the original script unless another one is given
     """
-    email_pattern = r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
-    emails = re.findall(email_pattern, text)
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_emails = []
+    if pattern != DEFAULT_PATTERN:
+        # RE2 can't encode lone surrogates, so replace them first
+        text = text.encode('utf-8', 'replace').decode('utf-8')
+        # Skip empty matches from patterns like 'a*'
+        return unique_emails([m.group() for m in get_pattern(pattern).finditer(text) if m.group()])
+    
+    # Lone surrogates can arrive through JSON, so let them pass through
+    return unique_emails(find_emails_in_bytes(text.encode('utf-8', 'surrogatepass')))
+
+
+def extract_emails_from_stream(stream, chunk_size=STREAM_CHUNK_SIZE, pattern=DEFAULT_PATTERN):
+    """
+    Extract emails from a binary stream one chunk at a time
+    The pattern only matches ASCII, so the bytes are never decoded
+    Each chunk is cut after its last byte that can't be part of an email,
+    and the rest is carried over, so no match is split between two scans
+    Large uploads are handed to worker processes one block at a time
+    """
+    if pattern != DEFAULT_PATTERN:
+        # A custom pattern may match anything, so scan the decoded upload
+        data = stream.read()
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            text = data.decode('latin-1')  # Never fails
+        return extract_emails_from_text(text, pattern)
+    
+    blocks = []  # (data, executor, future) in file order
+    pending = []
+    pending_size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size < PARALLEL_BLOCK_SIZE:
+            continue
+        cut = len(chunk.rstrip(EMAIL_CHARS))
+        if not cut:
+            # Still inside a run of email characters, keep reading
+            continue
+        pending[-1] = chunk[:cut]
+        block = b''.join(pending)
+        blocks.append((block, *submit_scan(block)))
+        pending = [chunk[cut:]]
+        pending_size = len(pending[0])
+    
+    emails = []
+    deadline = time.monotonic() + SCAN_TIMEOUT
+    for block, executor, future in blocks:
+        if future is not None:
+            try:
+                emails.extend(future.result(timeout=max(0, deadline - time.monotonic())))
+                continue
+            except FutureTimeout:
+                # Don't leave the remaining blocks queued for nobody
+                for _, _, other in blocks:
+                    if other is not None:
+                        other.cancel()
+                raise
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory), scan the block here
+                discard_scan_executor(executor)
+        emails.extend(find_emails_in_bytes(block))
+    emails.extend(find_emails_in_bytes(b''.join(pending)))
+    return unique_emails(emails)
+
+
+def find_emails_in_bytes(data):
+    """Return every email match in a bytes buffer, decoded to str"""
+    emails = []
+    for start, end in at_sign_regions(data):
+        if end - start > LINEAR_REGION_SIZE:
+            emails.extend(EMAIL_RE_LINEAR.findall(data, start, end))
+        else:
+            emails.extend(EMAIL_RE_BYTES.findall(data, start, end))
+    return [m.decode('ascii') for m in emails]
+
+
+def at_sign_regions(data):
+    """
+    Yield (start, end) regions of data around each '@'
+    bytes.find skips the text between them at memchr speed. Each region is
+    widened to the whole run of email characters around the '@', so the
+    regex sees every match in full.
+    """
+    end = 0
+    at = data.find(b'@')
+    while at != -1:
+        # Walk back to the byte before the run, doubling the window
+        window = 64
+        while True:
+            lo = max(end, at - window)
+            head = data[lo:at].rstrip(EMAIL_CHARS)
+            if head or lo == end:
+                start = lo + len(head)
+                break
+            window *= 2
+        end = EMAIL_RUN_RE.match(data, at).end()
+        yield start, end
+        at = data.find(b'@', end)
+
+
+def unique_emails(emails):
+    """Remove case-insensitive duplicates and sort the result"""
+    # Keep the first spelling seen for each address
+    seen = {}
     for email in emails:
-        email_lower = email.lower()
-        if email_lower not in seen:
-            seen.add(email_lower)
-            unique_emails.append(email)
-    return sorted(unique_emails, key=lambda x: x.lower())
+        seen.setdefault(email.lower(), email)
+    # The lowercase keys are already the sort keys
+    return [seen[key] for key in sorted(seen)]
 
 
 def extract_company_from_email(email):
     """Extract company/domain name from email"""
-    try:
-        domain = email.split('@')[1]
-        # Remove common TLDs to get company name
-        company = domain.split('.')[0]
-        return company.capitalize()
-    except:
+    # /api/download-csv passes client JSON through, which may not be strings
+    if not isinstance(email, str):
         return ""
+    # Only cache real addresses, so clients can't fill the cache with huge strings
+    if len(email) > MAX_EMAIL_LENGTH:
+        return company_from_email.__wrapped__(email)
+    return company_from_email(email)
+
+
+@lru_cache(maxsize=4096)
+def company_from_email(email):
+    """Cached company lookup for a str email"""
+    at = email.find('@')
+    if at < 0:
+        return ""
+    domain = email[at + 1:].partition('@')[0]
+    # Remove common TLDs to get company name
+    company = domain.partition('.')[0]
+    return company[:1].upper() + company[1:]
 
 
 def save_to_json(data, filename):
     """Save extracted data to JSON file"""
     filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4)
+    if orjson is not None:
+        with open(filepath, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
     return filepath
 
 
-def save_to_csv(emails, filename):
-    """Save extracted emails to CSV file"""
+def history_entry(filename, data):
+    """Summarize a saved extraction for the history list"""
+    return {
+        'filename': filename,
+        'source': data.get('source_file', 'Unknown'),
+        'total': data.get('total_emails', 0),
+        'time': data.get('extraction_time', '')
+    }
+
+
+def load_history():
+    """Fill the history index from the result files already on disk"""
+    global history_mtime
+    output_folder = app.config['OUTPUT_FOLDER']
+    try:
+        mtime = os.stat(output_folder).st_mtime_ns
+        with os.scandir(output_folder) as it:
+            # Only the newest files are needed, no need to sort them all
+            json_files = heapq.nlargest(
+                HISTORY_SIZE,
+                (e for e in it if e.name.endswith('.json')),
+                key=lambda e: e.name
+            )
+    except FileNotFoundError:
+        # The output folder was removed, so there is no history
+        mtime = None
+        json_files = []
+    
+    entries = []
+    for jf in json_files:
+        try:
+            with open(jf.path, 'rb') as f:
+                data = orjson.loads(f.read()) if orjson is not None else json.load(f)
+                entries.append(history_entry(jf.name, data))
+        except:
+            continue
+    
+    if mtime is not None and time.time_ns() - mtime < MTIME_GRANULARITY_NS:
+        # Too recent to trust, so load again next time
+        mtime = None
+    
+    with history_lock:
+        HISTORY_INDEX.clear()
+        HISTORY_INDEX.extend(entries)
+        history_mtime = mtime
+
+
+def save_to_csv(rows, filename):
+    """Save (email, company) rows to CSV file"""
     filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
     with open(filepath, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
         writer.writerow(['Email', 'Company/Domain'])
-        for email in emails:
-            company = extract_company_from_email(email)
-            writer.writerow([email, company])
+        writer.writerows(rows)
     return filepath
 
 
+# Fill the history index from earlier runs
+load_history()
+
+
 @app.route('/')
 def index():
     """Serve the main page"""
@@ -116,52 +411,45 @@ def extract_emails():
             'error': 'No file selected'
         }), 400
     
+    pattern = request.args.get('pattern') or DEFAULT_PATTERN
+    error = pattern_error(pattern)
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error
+        }), 400
+    
     try:
-        # Read file content
-        # Try different encodings
-        content = None
-        encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-        
-        for encoding in encodings:
-            try:
-                file.seek(0)  # Reset file pointer
-                content = file.read().decode(encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if content is None:
-            # If all encodings fail, read as binary and decode with errors='ignore'
-            file.seek(0)
-            content = file.read().decode('utf-8', errors='ignore')
-        
-        # Extract emails
-        emails = extract_emails_from_text(content)
+        # Scan the raw upload in chunks; no need to guess its encoding
+        emails = extract_emails_from_stream(file.stream, pattern=pattern)
         
-        # Generate timestamp for filenames
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Generate timestamp for filenames, precise enough that a new
+        # extraction never overwrites an earlier one
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
         
         # Save results
         json_filename = f'emails_{timestamp}.json'
         csv_filename = f'emails_{timestamp}.csv'
         
+        # Build CSV rows and JSON entries in a single pass
+        rows = []
+        entries = []
+        for email in emails:
+            company = extract_company_from_email(email)
+            rows.append((email, company))
+            entries.append({'email': email, 'company': company})
+        
         # Prepare data for JSON
         json_data = {
-            'source_file': secure_filename(file.filename),
+            'source_file': clean_filename(file.filename),
             'extraction_time': datetime.now().isoformat(),
             'total_emails': len(emails),
-            'emails': [
-                {
-                    'email': email,
-                    'company': extract_company_from_email(email)
-                }
-                for email in emails
-            ]
+            'emails': entries
         }
         
         # Save files
         json_path = save_to_json(json_data, json_filename)
-        csv_path = save_to_csv(emails, csv_filename)
+        csv_path = save_to_csv(rows, csv_filename)
         
         return jsonify({
             'success': True,
@@ -194,8 +482,16 @@ def extract_from_text():
             'error': 'No text provided'
         }), 400
     
+    pattern = request.args.get('pattern') or DEFAULT_PATTERN
+    error = pattern_error(pattern)
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error
+        }), 400
+    
     text = data['text']
-    emails = extract_emails_from_text(text)
+    emails = extract_emails_from_text(text, pattern)
     
     return jsonify({
         'success': True,
@@ -214,20 +510,20 @@ def extract_from_text():
 @app.route('/api/download/<filename>')
 def download_file(filename):
     """Download extracted results as CSV or JSON"""
-    filename = secure_filename(filename)
-    filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
+    filename = clean_filename(filename)
     
-    if not os.path.exists(filepath):
+    try:
+        return send_from_directory(
+            app.config['OUTPUT_FOLDER'],
+            filename,
+            as_attachment=True,
+            conditional=True
+        )
+    except NotFound:
         return jsonify({
             'success': False,
             'error': 'File not found'
         }), 404
-    
-    return send_file(
-        filepath,
-        as_attachment=True,
-        download_name=filename
-    )
 
 
 @app.route('/api/download-csv', methods=['POST'])
@@ -243,18 +539,18 @@ def download_csv_direct():
     
     emails = data['emails']
     
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
+    # Write the CSV straight into a bytes buffer
+    mem = io.BytesIO()
+    wrapper = io.TextIOWrapper(mem, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(wrapper)
     writer.writerow(['Email', 'Company/Domain'])
     
     for email in emails:
         company = extract_company_from_email(email)
         writer.writerow([email, company])
     
-    # Create bytes buffer
-    mem = io.BytesIO()
-    mem.write(output.getvalue().encode('utf-8'))
+    wrapper.flush()
+    wrapper.detach()  # Keep mem open when the wrapper is collected
     mem.seek(0)
     
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -270,31 +566,16 @@ def download_csv_direct():
 @app.route('/api/history')
 def get_history():
     """Get extraction history"""
-    output_folder = app.config['OUTPUT_FOLDER']
-    
-    if not os.path.exists(output_folder):
-        return jsonify({
-            'success': True,
-            'extractions': []
-        })
-    
-    files = os.listdir(output_folder)
-    json_files = [f for f in files if f.endswith('.json')]
+    # Other worker processes may have saved or cleared results
+    try:
+        mtime = os.stat(app.config['OUTPUT_FOLDER']).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime is None or mtime != history_mtime:
+        load_history()
     
-    extractions = []
-    for jf in sorted(json_files, reverse=True)[:20]:  # Last 20 extractions
-        filepath = os.path.join(output_folder, jf)
-        try:
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-                extractions.append({
-                    'filename': jf,
-                    'source': data.get('source_file', 'Unknown'),
-                    'total': data.get('total_emails', 0),
-                    'time': data.get('extraction_time', '')
-                })
-        except:
-            continue
+    with history_lock:
+        extractions = list(HISTORY_INDEX)
     
     return jsonify({
         'success': True,
@@ -308,8 +589,9 @@ def clear_history():
     output_folder = app.config['OUTPUT_FOLDER']
     
     try:
-        for f in os.listdir(output_folder):
-            os.remove(os.path.join(output_folder, f))
+        with os.scandir(output_folder) as it:
+            for entry in it:
+                os.remove(entry.path)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({
@@ -336,4 +618,5 @@ def server_error(e):
 
 
 if __name__ == '__main__':
+    print('Development server only. In production run: gunicorn -c gunicorn_conf.py app:app')
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration
+Run with: gunicorn -c gunicorn_conf.py app:app
+"""
+
+import os
+
+bind = '0.0.0.0:5000'
+
+# One process per core so extractions don't queue behind each other
+workers = max(2, os.cpu_count() or 1)
+worker_class = 'gthread'
+threads = 4
+# The workers already fill every core, so don't start scan pools on top
+raw_env = ['SCAN_WORKERS=0']
+
+# Load the app before forking so workers share the compiled patterns
+preload_app = True
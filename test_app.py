@@ -0,0 +1,205 @@
+"""
+Regression tests for the email extractor
+The chunked, '@'-prefiltered and parallel scans must find exactly what a
+plain re.findall over the whole input finds, whatever the boundaries are
+"""
+
+import io
+import os
+import random
+import re
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures.process import BrokenProcessPool
+
+import app
+
+EMAIL_RE = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
+EMAIL_RE_BYTES = re.compile(rb"[a-zA-Z0-9._%+\-]+@[a-zA-Z0-9.\-]+\.[a-zA-Z]{2,}")
+
+# Email characters, separators that can and can't join a match, non-ASCII
+ALPHABET = b'ab.@-_%+ ,c1Z\xc3\xa9'
+
+
+def reference_emails(emails):
+    """Deduplicate and sort the way the original extractor did"""
+    seen = set()
+    unique_emails = []
+    for email in emails:
+        email_lower = email.lower()
+        if email_lower not in seen:
+            seen.add(email_lower)
+            unique_emails.append(email)
+    return sorted(unique_emails, key=lambda x: x.lower())
+
+
+def random_inputs(seed, count=500, max_size=300):
+    """Yield random byte strings dense in '@' and email characters"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        data = bytes(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_size)))
+        # Sometimes add a run longer than any region or overlap window
+        if rng.random() < 0.1:
+            data += b'x' * rng.randint(60, 300) + b'@example.com ' + data
+        yield data
+
+
+class ExtractionTests(unittest.TestCase):
+
+    def assert_matches_findall(self, seed):
+        rng = random.Random(seed)
+        for data in random_inputs(seed):
+            expected = [m.decode('ascii') for m in EMAIL_RE_BYTES.findall(data)]
+            self.assertEqual(app.find_emails_in_bytes(data), expected, data)
+
+            chunk_size = rng.randint(1, 40)
+            with mock.patch.object(app, 'PARALLEL_BLOCK_SIZE', rng.randint(1, 80)):
+                self.assertEqual(
+                    app.extract_emails_from_stream(io.BytesIO(data), chunk_size),
+                    reference_emails(expected),
+                    (data, chunk_size)
+                )
+
+    def test_at_sign_regions(self):
+        with mock.patch.object(app, 'SCAN_WORKERS', 1):
+            self.assert_matches_findall(1)
+
+    def test_long_run(self):
+        # One 4MB run of email characters must stay linear in time and memory
+        data = b'x@y.' + b'a' * 4000000
+        expected = [data.decode('ascii')]
+        self.assertEqual(app.find_emails_in_bytes(data), expected)
+        with mock.patch.object(app, 'SCAN_WORKERS', 1):
+            self.assertEqual(app.extract_emails_from_stream(io.BytesIO(data)), expected)
+
+    def test_parallel_blocks(self):
+        with mock.patch.object(app, 'SCAN_WORKERS', 2), \
+                mock.patch.object(app, 'scan_executor', None), \
+                mock.patch.object(app, 'scan_executor_pid', None):
+            try:
+                for data in random_inputs(3, count=50):
+                    expected = reference_emails(
+                        [m.decode('ascii') for m in EMAIL_RE_BYTES.findall(data)]
+                    )
+                    with mock.patch.object(app, 'PARALLEL_BLOCK_SIZE', 16):
+                        self.assertEqual(
+                            app.extract_emails_from_stream(io.BytesIO(data), 8),
+                            expected,
+                            data
+                        )
+            finally:
+                if app.scan_executor is not None:
+                    app.scan_executor.shutdown()
+
+    def test_broken_pool(self):
+        # Blocks of a pool whose worker died are scanned inline instead
+        broken = mock.Mock()
+        broken.submit.return_value.result.side_effect = BrokenProcessPool
+        data = b'a@example.com ' * 20
+        with mock.patch.object(app, 'SCAN_WORKERS', 2), \
+                mock.patch.object(app, 'scan_executor', broken), \
+                mock.patch.object(app, 'scan_executor_pid', os.getpid()), \
+                mock.patch.object(app, 'PARALLEL_BLOCK_SIZE', 16):
+            self.assertEqual(app.extract_emails_from_stream(io.BytesIO(data), 8), ['a@example.com'])
+            self.assertIsNone(app.scan_executor)
+        broken.shutdown.assert_called_with(wait=False)
+
+    def test_scan_timeout(self):
+        # One deadline covers the whole upload, and queued blocks are cancelled
+        slow = mock.Mock()
+        slow.submit.return_value.result.side_effect = app.FutureTimeout
+        data = b'a@example.com ' * 20
+        with mock.patch.object(app, 'SCAN_WORKERS', 2), \
+                mock.patch.object(app, 'scan_executor', slow), \
+                mock.patch.object(app, 'scan_executor_pid', os.getpid()), \
+                mock.patch.object(app, 'PARALLEL_BLOCK_SIZE', 16):
+            with self.assertRaises(app.FutureTimeout):
+                app.extract_emails_from_stream(io.BytesIO(data), 8)
+        future = slow.submit.return_value
+        self.assertEqual(future.result.call_count, 1)
+        self.assertLessEqual(future.result.call_args.kwargs['timeout'], app.SCAN_TIMEOUT)
+        future.cancel.assert_called()
+
+    def test_text_matches_findall(self):
+        rng = random.Random(4)
+        chars = 'ab.@-_%+ ,c1Zé\ud800'
+        for _ in range(500):
+            text = ''.join(rng.choice(chars) for _ in range(rng.randint(0, 200)))
+            self.assertEqual(
+                app.extract_emails_from_text(text),
+                reference_emails(EMAIL_RE.findall(text)),
+                text
+            )
+
+    @unittest.skipIf(app.re2 is None, 'custom patterns need google-re2')
+    def test_custom_pattern_skips_empty_matches(self):
+        self.assertEqual(app.extract_emails_from_text('xx aa ab', 'a*'), ['a', 'aa'])
+
+
+class CompanyTests(unittest.TestCase):
+
+    def test_company(self):
+        self.assertEqual(app.extract_company_from_email('jo@acme.co.uk'), 'Acme')
+        self.assertEqual(app.extract_company_from_email('no-at-sign'), '')
+
+    def test_non_string_email(self):
+        # Client JSON may hold anything, which must not cause a 500
+        self.assertEqual(app.extract_company_from_email(None), '')
+        response = app.app.test_client().post(
+            '/api/download-csv', json={'emails': ['jo@acme.com', 5, None, ['x']]}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'jo@acme.com,Acme', response.data)
+
+    def test_long_email_not_cached(self):
+        email = 'a' * 300 + '@acme.com'
+        before = app.company_from_email.cache_info().currsize
+        self.assertEqual(app.extract_company_from_email(email), 'Acme')
+        self.assertEqual(app.company_from_email.cache_info().currsize, before)
+
+
+class HistoryTests(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.folder = tmp.name
+        patcher = mock.patch.dict(app.app.config, {'OUTPUT_FOLDER': self.folder})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.app.test_client()
+
+    def history(self):
+        response = self.client.get('/api/history')
+        self.assertEqual(response.status_code, 200)
+        return [e['filename'] for e in response.get_json()['extractions']]
+
+    def extract(self, text):
+        response = self.client.post(
+            '/api/extract',
+            data={'file': (io.BytesIO(text), 'list.txt')},
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['files']['json']
+
+    def test_save_and_clear(self):
+        self.assertEqual(self.history(), [])
+        first = self.extract(b'a@example.com')
+        self.assertEqual(self.history(), [first])
+        # Saved right after, so the folder mtime may not have changed
+        second = self.extract(b'b@example.com')
+        self.assertEqual(self.history(), [second, first])
+        self.assertEqual(self.client.post('/api/clear-history').status_code, 200)
+        self.assertEqual(self.history(), [])
+
+    def test_missing_output_folder(self):
+        self.extract(b'a@example.com')
+        self.assertEqual(len(self.history()), 1)
+        app.app.config['OUTPUT_FOLDER'] = os.path.join(self.folder, 'missing')
+        self.assertEqual(self.history(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()